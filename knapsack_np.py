@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Core search functionality for the KNApSAcK web database
+http://www.knapsackfamily.com/knapsack_core/top.php
+shared by the command line script and the GUI.
+It retrieves Name, CAS ID, KNApSAcK ID, and SMILES
+for each compound found by a user specified keyword.
+
+Created on Wed Jul 27 15:48:39 2022
+
+@author: Dr. Freddy Bernal
+"""
+# Import essentials
+import csv
+import functools
+import hashlib
+import html
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import html as lxml_html
+
+# requests-cache is optional: when available, responses are cached on
+# disk so repeated searches skip the network entirely
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# advertise brotli only when a decoder is installed
+try:
+    import brotli  # noqa: F401
+    _ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    _ACCEPT_ENCODING = 'gzip, deflate'
+
+# Precompiled patterns for the compound links and the pagination links
+# on a results page
+_HREF_RE = re.compile(rb'href=["\'](information\.php\?[^"\']+)["\']')
+_PAGE_RE = re.compile(rb'result\.php\?[^"\']*page=(\d+)')
+
+# Column names for the results
+_COLUMNS = ['names', 'cas', 'id', 'smiles']
+
+# Lifetime of cached keyword results (seconds)
+_RESULTS_CACHE_MAX_AGE = 30 * 24 * 3600
+
+# Precompiled patterns to pull the compound fields straight from the
+# raw html (the detail pages have a fixed schema)
+_TD4 = re.compile(rb'<td[^>]*colspan=["\']?4["\']?[^>]*>(.*?)</td>',
+                  re.S | re.I)
+_TAG = re.compile(rb'<[^>]+>')
+
+
+###############
+#  FUNCTIONS  #
+###############
+
+# Define a small token-bucket limiter shared by the fetch workers
+class _RateLimiter():
+    """
+    Allow at most `calls` requests per `period` seconds across all
+    threads. Bursts up to `calls` pass without waiting, so the cap
+    only throttles when the workers actually exceed it.
+    """
+
+    def __init__(self, calls=10, period=1.0):
+        self.calls = calls
+        self.period = period
+        self._timestamps = deque()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # drop timestamps that left the rolling window
+                while (self._timestamps
+                        and now - self._timestamps[0] >= self.period):
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.calls:
+                    self._timestamps.append(now)
+                    return
+                delay = self.period - (now - self._timestamps[0])
+            time.sleep(delay)
+
+
+# Define helper handing out one reusable lxml parser per thread
+# (parsers are not thread-safe, but rebuilding one per page wastes
+# builder setup on every call)
+_tls = threading.local()
+
+
+def _html_parser():
+    parser = getattr(_tls, 'parser', None)
+    if parser is None:
+        parser = lxml_html.HTMLParser(collect_ids=False)
+        _tls.parser = parser
+    return parser
+
+
+# Define helper telling whether a url is already in the disk cache
+def _is_cached(session, url: str)-> bool:
+    cache = getattr(session, 'cache', None)
+    return cache is not None and cache.contains(url=url)
+
+
+# Define memoized fetcher (module level so the cache does not hold a
+# reference to the KNApSAcKSearch instance)
+@functools.lru_cache(maxsize=512)
+def _fetch_html(session, url: str, limiter=None)-> bytes:
+    """
+    Download url through the given session and return the raw html.
+    Repeated calls for the same url within a session are served from
+    memory instead of re-issuing the request.
+    """
+    # cache hits are local reads, so they skip the rate limiter
+    if limiter is not None and not _is_cached(session, url):
+        limiter.wait()
+    return session.get(url, timeout=(5, 15)).content
+
+
+# Define memoized fetcher for compound detail pages
+@functools.lru_cache(maxsize=512)
+def _fetch_compound_html(session, url: str, limiter=None)-> bytes:
+    """
+    Download a compound detail page, stopping the transfer as soon as
+    all eight colspan=4 cells have been received (the rest of the page
+    is boilerplate the parser never looks at).
+    """
+    # cache hits are local reads, so they skip the rate limiter
+    if limiter is not None and not _is_cached(session, url):
+        limiter.wait()
+    buf = bytearray()
+    with session.get(url, timeout=(5, 15), stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(8192):
+            buf.extend(chunk)
+            # a chunk without a closing cell cannot complete the
+            # eighth fragment, so skip rescanning the buffer
+            if b'</td>' not in chunk:
+                continue
+            # stop once the eighth cell is complete in the buffer
+            if len(_TD4.findall(buf)) >= 8:
+                break
+    return bytes(buf)
+
+
+# Define helper extracting the compound links from a results page
+def _extract_links(content: bytes)-> list:
+    return [match.decode('ascii').replace('&amp;', '&')
+            for match in _HREF_RE.findall(content)]
+
+
+# Define parser for a compound detail page
+def _parse_compound(content: bytes)-> tuple:
+    """
+    Extract name(s), CAS ID, KNApSAcK ID, and SMILES from the html of
+    a compound detail page. The fields are pulled with a precompiled
+    regex over the raw bytes; lxml is used as fallback when the page
+    does not match the expected schema. Returns None for pages that
+    could not be retrieved or parsed.
+    """
+    if not content:
+        return None
+
+    # stop scanning once the eight needed cells are found (cached pages
+    # may carry the full document tail)
+    fragments = []
+    for match in _TD4.finditer(content):
+        fragments.append(match.group(1))
+        if len(fragments) == 8:
+            break
+    if len(fragments) >= 8:
+        # pages are utf-8; replace stray bytes rather than failing, and
+        # unescape entities (&amp;, &alpha;, ...) like the lxml path does
+        names = [html.unescape(chunk.decode('utf-8', errors='replace')).strip()
+                 for chunk in _TAG.split(fragments[0])
+                 if chunk.strip()]
+        cas = html.unescape(
+            _TAG.sub(b'', fragments[3]).decode('utf-8', errors='replace')).strip()
+        # an empty id cell means a malformed page; skip it rather than
+        # letting IndexError abort the whole search
+        parts = html.unescape(
+            _TAG.sub(b'', fragments[4]).decode('utf-8', errors='replace')).split()
+        if not parts:
+            return None
+        dbid = parts[0]
+        smi = html.unescape(
+            _TAG.sub(b'', fragments[7]).decode('utf-8', errors='replace')).strip()
+    else:
+        # schema drift guard: parse the page with lxml and select the
+        # cells via xpath (evaluated in C, no python-level tag walk)
+        tree = lxml_html.fromstring(content, parser=_html_parser())
+        data = tree.xpath("//td[@colspan='4']")
+        if len(data) < 8:
+            return None
+        names = [text.strip() for text in data[0].itertext()
+                 if text.strip()]
+        cas = data[3].text_content().strip()
+        parts = data[4].text_content().split()
+        if not parts:
+            return None
+        dbid = parts[0]
+        smi = data[7].text_content().strip()
+
+    return names, cas, dbid, smi
+
+
+# Define memoized fetch-and-parse step for one compound page
+@functools.lru_cache(maxsize=4096)
+def _fetch_parsed(session, url: str, limiter=None):
+    """
+    Fetch and parse one compound detail page. Memoized on the url, so
+    a compound appearing in several searches within a session is
+    downloaded and parsed only once; callers must treat the returned
+    row as read-only. Fetch errors propagate and are not cached.
+    """
+    return _parse_compound(_fetch_compound_html(session, url, limiter))
+
+
+################
+#  MAIN CLASS  #
+################
+
+class KNApSAcKSearch():
+
+    def __init__(self, searchtype, keyword, use_cache=True, refresh=False,
+                 max_workers=10):
+        self.base_url = 'http://www.knapsackfamily.com/knapsack_core/top.php'
+        # base url without the trailing page, shared by every request
+        self._url_prefix = self.base_url.rsplit('/', 1)[0]
+        self.searchtype = searchtype
+        self.keyword = keyword
+        # search url, percent-encoded once (so keywords with spaces or
+        # special characters search correctly)
+        query = urlencode({'sname': searchtype, 'word': keyword})
+        self._search_url = f'{self._url_prefix}/result.php?{query}'
+        self.use_cache = use_cache
+        self.refresh = refresh
+        # number of parallel fetches (higher values might cause
+        # conflicts with the KNApSAcK server)
+        self.max_workers = max_workers
+        # CAS -> organism mapping scraped from the results listing
+        # (filled by get_cmpds, used to annotate organism searches)
+        self._organism_by_cas = {}
+        # cap the request rate to stay polite with the server
+        self._limiter = _RateLimiter(calls=max_workers, period=1.0)
+        # Reuse one pooled session for all the requests (HTTP keep-alive),
+        # so each fetch does not pay for a new TCP connection. With
+        # requests-cache installed (and use_cache=True), responses are
+        # additionally stored in a local sqlite file so repeated
+        # searches are served from disk
+        if use_cache and requests_cache is not None:
+            self._session = requests_cache.CachedSession(
+                '.knapsack_cache', backend='sqlite',
+                expire_after=timedelta(days=30),
+                cache_control=True, stale_if_error=True)
+        else:
+            self._session = requests.Session()
+        retries = Retry(total=5, backoff_factor=0.5,
+                        status_forcelist=[429, 500, 502, 503, 504],
+                        respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=max_workers,
+                              pool_maxsize=max_workers,
+                              max_retries=retries)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        # ask for compressed bodies explicitly (some older servers send
+        # plain html without the hint) and identify the tool
+        self._session.headers.update({
+            'Accept-Encoding': _ACCEPT_ENCODING,
+            'User-Agent': 'Mozilla/5.0 (KNApSAcK-NP-search)',
+        })
+
+
+    # Allow use as a context manager, releasing the pooled connections
+    def close(self):
+        """Close the underlying HTTP session."""
+        self._session.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    # Define function to get links for compounds resulting from search
+    def get_cmpds(self)-> list:
+        """
+        Retrieve list of compounds for the configured search type and
+        keyword by scraping KNApSAcK database
+
+        Returns
+        -------
+        links : list
+            links to compounds from search results.
+
+        """
+
+        # get html content of results page (url precomputed in __init__)
+        search_url = self._search_url
+        content = _fetch_html(self._session, search_url, self._limiter)
+        # extract the compound links straight from the raw bytes (the
+        # precompiled pattern only matches information.php anchors, so
+        # navigation links never make it into the list)
+        links = _extract_links(content)
+        # only organism searches use the listing rows, so metabolite
+        # searches skip building the soup entirely
+        if self.searchtype == 'organism':
+            self._get_source(content)
+
+        # when the results are paginated, fetch the remaining pages in
+        # parallel and append their compound links
+        page_nums = sorted({int(num) for num in _PAGE_RE.findall(content)})
+        if page_nums:
+            page_urls = [f'{search_url}&page={num}' for num in page_nums]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                fetch = functools.partial(_fetch_html, self._session,
+                                          limiter=self._limiter)
+                for extra in executor.map(fetch, page_urls):
+                    links.extend(_extract_links(extra))
+                    if self.searchtype == 'organism':
+                        self._get_source(extra)
+
+        return links
+
+
+    # Define helper collecting the organism listed for each compound
+    def _get_source(self, content: bytes):
+        """
+        Collect the CAS -> organism mapping from the rows of a results
+        page. Organism searches use it to annotate each compound with
+        its source organism through a single dict lookup.
+        """
+        tree = lxml_html.fromstring(content, parser=_html_parser())
+        for row in tree.xpath('//tr'):
+            cells = row.xpath('./td')
+            if len(cells) > 5:
+                cas = cells[1].text_content().strip()
+                organism = cells[5].text_content().strip()
+                if cas:
+                    self._organism_by_cas[cas] = organism
+
+
+    # Define helper giving the result columns for the current search
+    def _columns(self)-> list:
+        if self.searchtype == 'organism':
+            return _COLUMNS + ['organism']
+        return _COLUMNS
+
+
+    # Define function to fetch each individual link and retrieve important information
+    def retrieve_data(self, links: list, callback=None):
+        """
+        Fetch each link provided and retrieve basic compound information.
+
+        Parameters
+        ----------
+        links : list
+            url links resulting from customized search with get_cmpds.
+        callback : callable, optional
+            function called as callback(done, total) after each retrieved
+            compound to report progress. The default is None.
+
+        Returns
+        -------
+        res : pd.DataFrame
+            Matrix with name(s), CAS ID, KNApSAcK ID and SMILES
+            for all the compounds obtained by the search.
+
+        """
+        # pandas is only needed for the dataframe output, so the import
+        # is deferred until results actually have to be built
+        import pandas as pd
+
+        rows = self._collect_rows(links, callback=callback)
+        # hand pandas one list per column (fixed string schema), which
+        # avoids the per-row dtype inference of record input
+        columns = self._columns()
+        if rows:
+            data = dict(zip(columns, map(list, zip(*rows))))
+        else:
+            data = {column: [] for column in columns}
+
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+
+    # Define helper turning compound links into urls (without duplicates)
+    def _compound_urls(self, links: list)-> list:
+        # deduplicate on the compound id rather than the full link, so
+        # the same compound reached through differently ordered query
+        # strings is still fetched only once
+        seen = set()
+        urls = []
+        for link in links:
+            # the id lives in the 'word' parameter, wherever it sits in
+            # the query string; fall back to the full link without one
+            cmpd_id = parse_qs(link.partition('?')[2]).get('word', [link])[-1]
+            if cmpd_id not in seen:
+                seen.add(cmpd_id)
+                urls.append(f'{self._url_prefix}/{link}')
+
+        return urls
+
+
+    # Define generator yielding one parsed row per page in completion order
+    def _iter_parsed(self, urls: list, callback=None):
+        # Retrieve data from each url in parallel (fetches overlap their
+        # network latency); each page is parsed and yielded as soon as
+        # it completes, together with its position in the link order
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._fetch_row, url): i
+                       for i, url in enumerate(urls)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                # report progress
+                if callback is not None:
+                    callback(done, len(urls))
+                # name(s), CAS ID, KNApSAcK ID, and SMILES
+                # (unretrievable or malformed pages are skipped)
+                row = future.result()
+                if row is not None:
+                    if self.searchtype == 'organism':
+                        # O(1) lookup against the listing mapping
+                        row += (self._organism_by_cas.get(row[1], ''),)
+                    yield futures[future], row
+
+
+    # Define helper collecting one row of data per compound link
+    def _collect_rows(self, links: list, callback=None)-> list:
+        urls = self._compound_urls(links)
+        collected = dict(self._iter_parsed(urls, callback=callback))
+
+        return [collected[idx] for idx in sorted(collected)]
+
+
+    # Define full search generator for streaming consumers
+    def search_iter(self, callback=None):
+        """
+        Run the search, yielding one (names, cas, id, smiles) tuple per
+        compound as soon as its page has been retrieved. Rows arrive in
+        completion order, so downstream tools can start consuming them
+        after a single round trip instead of after the whole search.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            function called as callback(done, total) after each retrieved
+            compound. The default is None.
+
+        Yields
+        ------
+        row : tuple
+            name(s), CAS ID, KNApSAcK ID and SMILES of one compound.
+
+        """
+        links = self.get_cmpds()
+        for _, row in self._iter_parsed(self._compound_urls(links),
+                                        callback=callback):
+            yield row
+
+
+    # Define helper retrieving the parsed row for a single compound page
+    def _fetch_row(self, url: str):
+        # a page that keeps failing after the retries is skipped (and
+        # not cached), instead of aborting the whole search
+        try:
+            return _fetch_parsed(self._session, url, self._limiter)
+        except requests.RequestException as e:
+            print(f'Could not retrieve {url}: {e}')
+            return None
+
+
+
+    # Define full search function
+    def search_with_progress(self, callback=None):
+        """
+        Run the search and retrieve the data for all compounds found,
+        reporting per-compound progress through callback.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            function called as callback(done, total) after each retrieved
+            compound. The default is None.
+
+        Returns
+        -------
+        res : pd.DataFrame or None
+            search results, or None if nothing was found.
+
+        """
+
+        # Search for compounds using user input
+        links = self.get_cmpds()
+        if links:
+            return self.retrieve_data(links, callback=callback)
+
+        return None
+
+
+    # Define full search function writing results directly to csv
+    def search_to_csv(self, filename: str, callback=None):
+        """
+        Run the search and write the results to a csv file with the
+        stdlib csv writer, without building a dataframe.
+
+        Parameters
+        ----------
+        filename : str
+            name of the csv file to create.
+        callback : callable, optional
+            function called as callback(done, total) after each retrieved
+            compound. The default is None.
+
+        Returns
+        -------
+        n : int or None
+            number of compounds written, or None if nothing was found.
+
+        """
+
+        # Serve the whole search from the keyword cache when possible
+        cache_path = self._results_cache_path()
+        if self.use_cache and not self.refresh and cache_path.exists() \
+                and time.time() - cache_path.stat().st_mtime < _RESULTS_CACHE_MAX_AGE:
+            shutil.copyfile(cache_path, filename)
+            with open(filename, newline='') as f:
+                return sum(1 for _ in f) - 1
+
+        # Search for compounds using user input
+        links = self.get_cmpds()
+        if not links:
+            return None
+
+        # Stream each row to the buffered file as soon as its page has
+        # been retrieved (names joined by '|')
+        n = 0
+        with open(filename, 'w', newline='', buffering=1 << 20) as f:
+            writer = csv.writer(f)
+            writer.writerow(self._columns())
+            for _, row in self._iter_parsed(self._compound_urls(links),
+                                            callback=callback):
+                writer.writerow(('|'.join(row[0]), *row[1:]))
+                n += 1
+
+        # Keep a copy so repeating the same keyword skips the crawl
+        if self.use_cache and n:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(filename, cache_path)
+
+        return n
+
+
+    # Define helper locating the cached csv for the current search
+    def _results_cache_path(self)-> Path:
+        key = hashlib.sha1(
+            f'{self.searchtype}|{self.keyword.strip().lower()}'.encode()
+        ).hexdigest()
+        return Path.home() / '.cache' / 'knapsack' / f'{key}.csv'